@@ -11,6 +11,9 @@ DROP TABLE IF EXISTS PowerLines CASCADE;
 DROP TABLE IF EXISTS Substations CASCADE;
 DROP TABLE IF EXISTS Regions CASCADE;
 
+-- Потрібне для EXCLUDE-обмеження з операторами '=' над INT/VARCHAR у GiST
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
 -- =========================================================
 -- MODULE 1: ДОВІДНИКИ (STATIC DATA)
 -- =========================================================
@@ -129,10 +132,19 @@ CREATE TABLE MaintenanceEvents (
     object_id INT NOT NULL,
     object_type VARCHAR(20) NOT NULL CHECK (object_type IN ('Підстанція', 'Лінія')),
     reason VARCHAR(255),
+    -- Вікно ремонту як діапазон [start, end) для запитів перетину (&&, @>)
+    maint_period TSTZRANGE GENERATED ALWAYS AS (tstzrange(start_time, end_time, '[)')) STORED,
     -- Перевірка хронології
-    CHECK (end_time > start_time)
+    CHECK (end_time > start_time),
+    -- Один об'єкт не може мати два ремонти, що перетинаються в часі
+    CONSTRAINT excl_maint_object_overlap EXCLUDE USING gist (
+        object_type WITH =,
+        object_id WITH =,
+        maint_period WITH &&
+    )
 );
-CREATE INDEX idx_maint_time ON MaintenanceEvents(start_time, end_time);
+-- GiST-індекс для запитів "що в ремонті в момент T / у вікні [a, b]"
+CREATE INDEX idx_maint_period ON MaintenanceEvents USING gist (maint_period);
 
 CREATE TABLE EnergyPricing (
     timestamp TIMESTAMPTZ NOT NULL,
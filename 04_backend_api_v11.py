@@ -1,8 +1,10 @@
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from fastapi import FastAPI
+from fastapi import FastAPI, Query
 from fastapi.middleware.cors import CORSMiddleware
+from typing import Optional
 import datetime
+import threading
 import os
 from dotenv import load_dotenv
 
@@ -52,20 +54,120 @@ def convert_decimals(data):
                 row[key] = float(value)
     return data
 
+# ---
+# 1.1. Індекс Планових Ремонтів (Interval Tree)
+# ---
+
+MAINTENANCE_CACHE_TTL = datetime.timedelta(seconds=60)
+
+SQL_MAINTENANCE_EVENTS = """
+    SELECT me.event_id, me.start_time, me.end_time, me.reason, me.object_id, me.object_type,
+           CASE WHEN me.object_type = 'Підстанція' THEN s.substation_name
+                WHEN me.object_type = 'Лінія' THEN pl.line_name
+                ELSE 'N/A' END AS object_name
+    FROM MaintenanceEvents me
+    LEFT JOIN Substations s ON me.object_id = s.substation_id AND me.object_type = 'Підстанція'
+    LEFT JOIN PowerLines pl ON me.object_id = pl.line_id AND me.object_type = 'Лінія'
+"""
+
+class MaintenanceIntervalTree:
+    """
+    Статичне інтервальне дерево вікон ремонту [start_time, end_time).
+    Збалансоване BST над відсортованим за start_time списком; кожен вузол
+    зберігає max(end_time) свого піддерева, що дозволяє відсікати гілки.
+    Запит перетину: O(log n + k).
+    """
+
+    def __init__(self, events):
+        self.events = sorted(events, key=lambda e: (e['start_time'], e['event_id']))
+        self._max_end = [None] * len(self.events)
+        self._build(0, len(self.events))
+
+    def _build(self, lo, hi):
+        if lo >= hi: return None
+        mid = (lo + hi) // 2
+        max_end = self.events[mid]['end_time']
+        for child_end in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if child_end is not None and child_end > max_end:
+                max_end = child_end
+        self._max_end[mid] = max_end
+        return max_end
+
+    def _query(self, lo, hi, start, end, result):
+        if lo >= hi: return
+        mid = (lo + hi) // 2
+        # Усі вікна піддерева закінчились до початку запиту
+        if self._max_end[mid] <= start: return
+        self._query(lo, mid, start, end, result)
+        event = self.events[mid]
+        if event['start_time'] <= end:
+            if event['end_time'] > start:
+                result.append(event)
+            self._query(mid + 1, hi, start, end, result)
+
+    def overlapping(self, start, end):
+        """Ремонти, що перетинаються з вікном [start, end] (у порядку start_time)."""
+        result = []
+        self._query(0, len(self.events), start, end, result)
+        return result
+
+    def at(self, moment):
+        """Ремонти, що тривають у момент moment."""
+        return self.overlapping(moment, moment)
+
+    def find(self, object_type, object_id, moment):
+        """Ремонт конкретного об'єкта в момент moment (або None)."""
+        for event in self.at(moment):
+            if event['object_type'] == object_type and event['object_id'] == object_id:
+                return event
+        return None
+
+_maintenance_cache = {"tree": None, "loaded_at": None}
+_maintenance_lock = threading.Lock()
+
+def get_maintenance_tree(conn):
+    """Повертає закешоване дерево ремонтів (перебудова раз на MAINTENANCE_CACHE_TTL)."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    with _maintenance_lock:
+        loaded_at = _maintenance_cache["loaded_at"]
+        if _maintenance_cache["tree"] is None or now - loaded_at > MAINTENANCE_CACHE_TTL:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(SQL_MAINTENANCE_EVENTS)
+                events = cursor.fetchall()
+            _maintenance_cache["tree"] = MaintenanceIntervalTree(events)
+            _maintenance_cache["loaded_at"] = now
+            print(f"🔧 Індекс ремонтів перебудовано ({len(events)} подій).")
+        return _maintenance_cache["tree"]
+
+def to_utc(moment):
+    """Час без часової зони (з query-параметрів) трактується як UTC."""
+    if moment is not None and moment.tzinfo is None:
+        return moment.replace(tzinfo=datetime.timezone.utc)
+    return moment
+
+def maintenance_fields(event):
+    """Поля позначки ремонту для вузлів карти / тривог (події дерева не змінюються)."""
+    if event is None:
+        return {"under_maintenance": False, "maintenance_reason": None, "maintenance_end": None}
+    return {"under_maintenance": True, "maintenance_reason": event['reason'], "maintenance_end": event['end_time'].isoformat()}
+
 # ---
 # 2. - Інтерактивні Тривоги
 # ---
 
 @app.get("/api/v11/alerts/active")
-def get_active_alerts():
+def get_active_alerts(suppress_maintenance: bool = False):
     """
     Повертає ТІЛЬКИ активні ('NEW') тривоги.
+    Тривоги по підстанціях, що були в плановому ремонті в момент тривоги,
+    позначаються 'under_maintenance' (або приховуються при suppress_maintenance).
     """
     print("Запит: /api/v11/alerts/active")
     sql_query = """
         SELECT 
             a.alert_id, 
             a.timestamp, 
+            a.substation_id, 
             s.substation_name, 
             s.capacity_mw AS substation_limit, 
             a.description AS alert_description
@@ -82,8 +184,15 @@ def get_active_alerts():
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
             cursor.execute(sql_query)
             data = cursor.fetchall()
-        print(f"✅ Знайдено {len(data)} активних тривог.")
-        return convert_decimals(data)
+        tree = get_maintenance_tree(conn)
+        alerts = []
+        for row in data:
+            event = tree.find('Підстанція', row['substation_id'], row['timestamp'])
+            if event is not None and suppress_maintenance: continue
+            row.update(maintenance_fields(event))
+            alerts.append(row)
+        print(f"✅ Знайдено {len(alerts)} активних тривог.")
+        return convert_decimals(alerts)
     except Exception as e:
         print(f"❌ ПОМИЛКА SQL-ЗАПИТУ (Active Alerts): {e}")
         return {"error": f"Помилка запиту: {e}"}
@@ -185,8 +294,8 @@ def get_full_network_map_data():
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
             sql_nodes = """
-                WITH LatestLoads AS (SELECT DISTINCT ON (substation_id) substation_id, actual_load_mw FROM LoadMeasurements ORDER BY substation_id, timestamp DESC)
-                SELECT s.substation_id, s.substation_name, s.latitude, s.longitude, s.capacity_mw, COALESCE(ll.actual_load_mw, 0) AS current_load,
+                WITH LatestLoads AS (SELECT DISTINCT ON (substation_id) substation_id, actual_load_mw, timestamp FROM LoadMeasurements ORDER BY substation_id, timestamp DESC)
+                SELECT s.substation_id, s.substation_name, s.latitude, s.longitude, s.capacity_mw, COALESCE(ll.actual_load_mw, 0) AS current_load, ll.timestamp AS load_timestamp,
                        CASE WHEN s.capacity_mw > 0 THEN (COALESCE(ll.actual_load_mw, 0) / s.capacity_mw) * 100 ELSE 0 END AS load_percent
                 FROM Substations s LEFT JOIN LatestLoads ll ON s.substation_id = ll.substation_id
                 WHERE s.latitude IS NOT NULL AND s.longitude IS NOT NULL;
@@ -194,13 +303,20 @@ def get_full_network_map_data():
             cursor.execute(sql_nodes)
             nodes = cursor.fetchall()
             sql_edges = """
-                WITH LatestLineLoads AS (SELECT DISTINCT ON (line_id) line_id, actual_load_mw FROM LineMeasurements ORDER BY line_id, timestamp DESC)
-                SELECT pl.line_id, pl.from_substation_id, pl.to_substation_id, pl.line_name, pl.max_load_mw, COALESCE(lll.actual_load_mw, 0) AS current_load,
+                WITH LatestLineLoads AS (SELECT DISTINCT ON (line_id) line_id, actual_load_mw, timestamp FROM LineMeasurements ORDER BY line_id, timestamp DESC)
+                SELECT pl.line_id, pl.from_substation_id, pl.to_substation_id, pl.line_name, pl.max_load_mw, COALESCE(lll.actual_load_mw, 0) AS current_load, lll.timestamp AS load_timestamp,
                        CASE WHEN pl.max_load_mw > 0 THEN (COALESCE(lll.actual_load_mw, 0) / pl.max_load_mw) * 100 ELSE 0 END AS load_percent
                 FROM PowerLines pl LEFT JOIN LatestLineLoads lll ON pl.line_id = lll.line_id;
             """
             cursor.execute(sql_edges)
             edges = cursor.fetchall()
+        # Стан ремонту - на момент останнього виміру, який і показано на карті
+        tree = get_maintenance_tree(conn)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for node in nodes:
+            node.update(maintenance_fields(tree.find('Підстанція', node['substation_id'], node['load_timestamp'] or now)))
+        for edge in edges:
+            edge.update(maintenance_fields(tree.find('Лінія', edge['line_id'], edge['load_timestamp'] or now)))
         print("✅ Запит гео-топології мережі виконано.")
         return {"nodes": convert_decimals(nodes), "edges": convert_decimals(edges)}
     except Exception as e:
@@ -227,23 +343,35 @@ def get_consumer_type_analysis():
         if conn: conn.close()
 
 @app.get("/api/v5/maintenance/calendar")
-def get_maintenance_calendar():
+def get_maintenance_calendar(
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0)
+):
+    """
+    Календар ремонтів, що перетинаються з вікном [start, end] (межі необов'язкові).
+    Пошук по GiST-індексу idx_maint_period; 'total_count' - для пагінації.
+    """
     print("Запит: /api/v5/maintenance/calendar")
     sql_query = """
-        SELECT me.start_time, me.end_time, me.reason, me.object_type,
+        SELECT me.event_id, me.start_time, me.end_time, me.reason, me.object_type,
                CASE WHEN me.object_type = 'Підстанція' THEN s.substation_name
                     WHEN me.object_type = 'Лінія' THEN pl.line_name
-                    ELSE 'N/A' END AS object_name
+                    ELSE 'N/A' END AS object_name,
+               COUNT(*) OVER () AS total_count
         FROM MaintenanceEvents me
         LEFT JOIN Substations s ON me.object_id = s.substation_id AND me.object_type = 'Підстанція'
         LEFT JOIN PowerLines pl ON me.object_id = pl.line_id AND me.object_type = 'Лінія'
-        ORDER BY me.start_time ASC;
+        WHERE me.maint_period && tstzrange(%s::timestamptz, %s::timestamptz, '[]')
+        ORDER BY me.start_time ASC, me.event_id ASC
+        LIMIT %s OFFSET %s;
     """
     conn = get_db_connection()
     if not conn: return {"error": "DB Connection failed"}
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(sql_query)
+            cursor.execute(sql_query, (to_utc(start), to_utc(end), limit, offset))
             data = cursor.fetchall()
         return convert_decimals(data)
     except Exception as e:
@@ -252,6 +380,62 @@ def get_maintenance_calendar():
     finally:
         if conn: conn.close()
 
+@app.get("/api/v11/maintenance/active")
+def get_active_maintenance(at: Optional[datetime.datetime] = None):
+    """
+    Повертає об'єкти, що перебувають у ремонті в момент 'at' (за замовчуванням - зараз).
+    Відповідь з in-memory інтервального дерева, без запиту до MaintenanceEvents.
+    """
+    print("Запит: /api/v11/maintenance/active")
+    moment = to_utc(at) or datetime.datetime.now(datetime.timezone.utc)
+    conn = get_db_connection()
+    if not conn: return {"error": "DB Connection failed"}
+    try:
+        tree = get_maintenance_tree(conn)
+        return convert_decimals([dict(event) for event in tree.at(moment)])
+    except Exception as e:
+        print(f"❌ ПОМИЛКА SQL-ЗАПИТУ (Active Maintenance): {e}")
+        return {"error": f"Помилка запиту: {e}"}
+    finally:
+        if conn: conn.close()
+
+@app.get("/api/v11/maintenance/conflicts")
+def get_maintenance_conflicts():
+    """
+    Конфлікти: останній вимір навантаження об'єкта потрапляє у вікно його ремонту
+    (об'єкт мав би бути відключений, але телеметрія надходить).
+    """
+    print("Запит: /api/v11/maintenance/conflicts")
+    sql_latest = """
+        SELECT 'Підстанція' AS object_type, s.substation_id AS object_id, s.substation_name AS object_name, ll.timestamp AS load_timestamp, ll.actual_load_mw AS current_load
+        FROM (SELECT DISTINCT ON (substation_id) substation_id, actual_load_mw, timestamp FROM LoadMeasurements ORDER BY substation_id, timestamp DESC) ll
+        JOIN Substations s ON ll.substation_id = s.substation_id
+        UNION ALL
+        SELECT 'Лінія', pl.line_id, pl.line_name, lll.timestamp, lll.actual_load_mw
+        FROM (SELECT DISTINCT ON (line_id) line_id, actual_load_mw, timestamp FROM LineMeasurements ORDER BY line_id, timestamp DESC) lll
+        JOIN PowerLines pl ON lll.line_id = pl.line_id;
+    """
+    conn = get_db_connection()
+    if not conn: return {"error": "DB Connection failed"}
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(sql_latest)
+            latest = cursor.fetchall()
+        tree = get_maintenance_tree(conn)
+        conflicts = []
+        for row in latest:
+            event = tree.find(row['object_type'], row['object_id'], row['load_timestamp'])
+            if event is None: continue
+            row.update({"event_id": event['event_id'], "start_time": event['start_time'], "end_time": event['end_time'], "reason": event['reason']})
+            conflicts.append(row)
+        print(f"✅ Знайдено {len(conflicts)} конфліктів ремонт/телеметрія.")
+        return convert_decimals(conflicts)
+    except Exception as e:
+        print(f"❌ ПОМИЛКА SQL-ЗАПИТУ (Maintenance Conflicts): {e}")
+        return {"error": f"Помилка запиту: {e}"}
+    finally:
+        if conn: conn.close()
+
 @app.get("/api/v4/forecast/live")
 def get_live_forecast_fast():
     print("Запит: /api/v4/forecast/live (ШВИДКА ВЕРСІЯ)")